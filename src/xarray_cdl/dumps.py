@@ -27,72 +27,165 @@
 # OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
 # OF THE POSSIBILITY OF SUCH DAMAGE.
+import functools
+import io
+import itertools
+import math
+
 import numpy as np
 import xarray
 
 
-def _format_value(value):
-    """Format a value for CDL output"""
-    if isinstance(value, str):
-        return f'"{value}"'
-    elif isinstance(value, (int, float)):
-        if np.isnan(value):
+def _format_float(value):
+    if math.isnan(value):
+        return "NaN"
+    return f"{value}"
+
+
+# formatters for the exact python types of common attribute values
+_VALUE_FORMATTERS = {
+    str: lambda value: f'"{value}"',
+    int: lambda value: f"{value}",
+    float: _format_float,
+    bool: lambda value: f"{int(value)}",
+}
+
+
+def _format_value_slow(value):
+    """Format a value whose type has no entry in _VALUE_FORMATTERS"""
+    if isinstance(value, (np.generic, np.ndarray)) and np.ndim(value) == 0:
+        # numpy scalars and 0-d arrays. Use str() since formatting a numpy
+        # float goes through python float and prints float32 at full width.
+        array = np.asarray(value)
+        kind = array.dtype.kind
+        value = array[()]
+        if kind == "O":
+            # object arrays hold a plain python object
+            return _format_value(value)
+        elif kind == "f" and np.isnan(value):
             return "NaN"
+        elif kind == "b":
+            return f"{int(value)}"
+        elif kind == "U":
+            return f'"{value}"'
         return str(value)
-    elif isinstance(value, bool):
-        return str(int(value))
+    elif isinstance(value, str):
+        return f'"{value}"'
+    return f"{value}"
+
+
+def _format_value(value):
+    """Format a value for CDL output"""
+    return _VALUE_FORMATTERS.get(type(value), _format_value_slow)(value)
+
+
+def _format_values(data):
+    """Format the values of an array as a flat list of CDL strings"""
+    # Python's repr of ints and doubles matches numpy's output and is faster
+    # than astype(str)
+    flat_data = np.asarray(data).ravel()
+    if flat_data.dtype.kind == "b":
+        # CDL has no boolean type; bools are written as byte 1/0
+        formatted_values = list(map(repr, flat_data.astype(np.int8).tolist()))
+    elif flat_data.dtype.kind in "iu" or flat_data.dtype == np.float64:
+        formatted_values = list(map(repr, flat_data.tolist()))
+    elif flat_data.dtype.kind == "U":
+        formatted_values = [
+            '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+            for value in flat_data.tolist()
+        ]
     else:
-        return str(value)
+        formatted_values = flat_data.astype(str).tolist()
+    if flat_data.dtype.kind in "fc":
+        for i in np.flatnonzero(np.isnan(flat_data)).tolist():
+            formatted_values[i] = "NaN"
+    return formatted_values
 
 
-def _format_data_array(data, max_items_per_line=8):
-    """Format a data array for CDL output"""
-    if data.size == 0:
-        return ""
-    
-    # Flatten the array and convert to list
-    flat_data = data.ravel()
-    
-    # Format each value
-    formatted_values = []
-    for val in flat_data:
-        if np.isnan(val):
-            formatted_values.append("NaN")
-        elif isinstance(val, (int, float)):
-            formatted_values.append(str(val))
-        else:
-            formatted_values.append(str(val))
-    
-    # Split into lines
-    lines = []
-    for i in range(0, len(formatted_values), max_items_per_line):
-        line_values = formatted_values[i:i + max_items_per_line]
-        lines.append(", ".join(line_values))
-    
-    return ",\n    ".join(lines)
+def _format_data_array(blocks, max_items_per_line=8):
+    """Format data for CDL output, yielding one line at a time
+
+    The values of each array in ``blocks`` are written in order, and lines
+    continue across block boundaries.
+    """
+    values = itertools.chain.from_iterable(map(_format_values, blocks))
+    while True:
+        line = ", ".join(itertools.islice(values, max_items_per_line))
+        if not line:
+            return
+        yield line
+
+
+def _iter_blocks(data):
+    """Iterate over a data array in C order, one chunk at a time
+
+    Dask arrays are computed one chunk of the first dimension at a time, so
+    only a slab of the array is held in memory. Other arrays are yielded
+    whole.
+    """
+    if not hasattr(data, "blocks") or data.ndim == 0:
+        yield np.asarray(data)
+        return
+
+    start = 0
+    for size in data.chunks[0]:
+        if size > 0:
+            yield np.asarray(data[start:start + size])
+        start += size
 
 
+def _char_variable(var, sizes):
+    """Return the dims and string values of ``var`` as a CDL char variable
+
+    Arrays of single characters (S1) already have a character dimension,
+    and each row along it is one string. Other string arrays get a new
+    character dimension, added to ``sizes``, as wide as their longest value.
+    """
+    values = np.asarray(var.values)
+    if values.dtype == "S1" and values.ndim > 0:
+        if values.shape[-1] == 0:
+            return var.dims, np.full(values.shape[:-1], "")
+        rows = values.reshape(-1, values.shape[-1])
+        strings = [b"".join(row.tolist()).decode() for row in rows]
+        strings = np.array(strings, dtype=str).reshape(values.shape[:-1])
+        return var.dims, strings
+
+    if values.dtype.kind == "S":
+        strings = np.char.decode(values, "utf-8")
+    else:
+        strings = values.astype(str)
+    width = max([len(value.encode()) for value in strings.ravel().tolist()], default=1)
+    width = max(width, 1)
+    char_dim = f"string{width}"
+    while sizes.get(char_dim, width) != width:
+        char_dim += "_"
+    sizes[char_dim] = width
+    return var.dims + (char_dim,), strings
+
+
+# CDL type names keyed by numpy dtype kind, with overrides for specific widths
+_CDL_TYPE_BY_KIND = {
+    "f": "float",
+    "i": "int",
+    "u": "int",
+    "b": "byte",
+    "U": "char",
+    "S": "char",
+    "O": "char",
+}
+_CDL_TYPE_BY_KIND_AND_SIZE = {
+    ("f", 8): "double",
+    ("i", 8): "long",
+}
+
+
+@functools.lru_cache(maxsize=None)
 def _get_dtype_string(dtype):
     """Convert numpy dtype to CDL dtype string"""
-    dtype_str = str(dtype)
-    if dtype_str.startswith('float'):
-        if dtype_str == 'float64':
-            return 'double'
-        else:
-            return 'float'
-    elif dtype_str.startswith('int'):
-        if dtype_str == 'int64':
-            return 'long'
-        else:
-            return 'int'
-    elif dtype_str.startswith('uint'):
-        return 'int'
-    elif dtype_str == 'bool':
-        return 'byte'
-    elif dtype_str.startswith('str') or dtype_str.startswith('object'):
-        return 'char'
-    else:
-        return 'float'  # default fallback
+    try:
+        return _CDL_TYPE_BY_KIND_AND_SIZE[dtype.kind, dtype.itemsize]
+    except KeyError:
+        return _CDL_TYPE_BY_KIND.get(dtype.kind, "float")  # default fallback
 
 
 def dumps(ds: xarray.Dataset, name: str = "dataset") -> str:
@@ -141,65 +234,68 @@ def dumps(ds: xarray.Dataset, name: str = "dataset") -> str:
         lon = 0, 1;
     }
     """
-    lines = [f"netcdf {name} {{"]
-    
-    # Dimensions section
-    lines.append("dimensions:")
-    for dim in ds.dims:
-        size = ds.sizes[dim]
-        lines.append(f"    {dim} = {size};")
-    
-    # Variables section
-    lines.append("variables:")
-    
-    # Add coordinate variables first
-    for coord_name, coord_var in ds.coords.items():
-        dtype_str = _get_dtype_string(coord_var.dtype)
-        if coord_var.dims:
-            dims_str = "(" + ", ".join(coord_var.dims) + ")"
-        else:
-            dims_str = ""
-        lines.append(f"    {dtype_str} {coord_name}{dims_str};")
+    # Character dimensions needed by string variables are added to sizes
+    sizes = dict(ds.sizes)
     
-    # Add data variables
-    for var_name, var in ds.data_vars.items():
+    # Declarations, attributes and data of every variable are collected in a
+    # single pass, coordinate variables first
+    decl_buf = io.StringIO()
+    attr_buf = io.StringIO()
+    data_buf = io.StringIO()
+    for var_name, var in itertools.chain(ds.coords.items(), ds.data_vars.items()):
         dtype_str = _get_dtype_string(var.dtype)
-        if var.dims:
-            dims_str = "(" + ", ".join(var.dims) + ")"
+        dims, data, attrs = var.dims, var.data, var.attrs
+        if dtype_str == "char":
+            dims, data = _char_variable(var, sizes)
+            if var.dtype.kind != "S" and "_Encoding" not in attrs:
+                # so that loads decodes the characters back to str
+                attrs = {**attrs, "_Encoding": "utf-8"}
+        elif var.dtype.kind == "b" and "dtype" not in attrs:
+            # so that decode_cf turns the bytes back into bools
+            attrs = {**attrs, "dtype": "bool"}
+        if dims:
+            dims_str = "(" + ", ".join(dims) + ")"
         else:
             dims_str = ""
-        lines.append(f"    {dtype_str} {var_name}{dims_str};")
+        decl_buf.write(f"    {dtype_str} {var_name}{dims_str};\n")
     
-    # Variable attributes
-    for var_name, var in ds.coords.items():
-        for attr_name, attr_value in var.attrs.items():
-            lines.append(f"        {var_name}:{attr_name} = {_format_value(attr_value)};")
+        attr_buf.write("".join([
+            f"        {var_name}:{attr_name} = {_format_value(attr_value)};\n"
+            for attr_name, attr_value in attrs.items()
+        ]))
     
-    for var_name, var in ds.data_vars.items():
-        for attr_name, attr_value in var.attrs.items():
-            lines.append(f"        {var_name}:{attr_name} = {_format_value(attr_value)};")
+        if var.size > 0:
+            data_buf.write(f"    {var_name} = ")
+            for i, line in enumerate(_format_data_array(_iter_blocks(data))):
+                if i > 0:
+                    data_buf.write(",\n    ")
+                data_buf.write(line)
+            data_buf.write(";\n")
     
-    # Global attributes
-    if ds.attrs:
-        lines.append("    // global attributes")
-        for attr_name, attr_value in ds.attrs.items():
-            lines.append(f"        :{attr_name} = {_format_value(attr_value)};")
+    buf = io.StringIO()
+    buf.write(f"netcdf {name} {{\n")
     
-    # Data section
-    lines.append("data:")
+    # Dimensions section
+    buf.write("dimensions:\n")
+    for dim, size in sizes.items():
+        buf.write(f"    {dim} = {size};\n")
     
-    # Add coordinate data
-    for coord_name, coord_var in ds.coords.items():
-        if coord_var.size > 0:
-            data_str = _format_data_array(coord_var.values)
-            lines.append(f"    {coord_name} = {data_str};")
+    # Variables section
+    buf.write("variables:\n")
+    buf.write(decl_buf.getvalue())
+    buf.write(attr_buf.getvalue())
     
-    # Add variable data
-    for var_name, var in ds.data_vars.items():
-        if var.size > 0:
-            data_str = _format_data_array(var.values)
-            lines.append(f"    {var_name} = {data_str};")
+    # Global attributes
+    if ds.attrs:
+        buf.write("    // global attributes\n")
+        buf.write("".join([
+            f"        :{attr_name} = {_format_value(attr_value)};\n"
+            for attr_name, attr_value in ds.attrs.items()
+        ]))
     
-    lines.append("}")
+    # Data section
+    buf.write("data:\n")
+    buf.write(data_buf.getvalue())
+    buf.write("}")
     
-    return "\n".join(lines) 
+    return buf.getvalue()
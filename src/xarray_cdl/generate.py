@@ -29,6 +29,10 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
 # OF THE POSSIBILITY OF SUCH DAMAGE.
 from typing import Mapping
+import re
+import sys
+import warnings
+
 import lark
 import numpy as np
 import xarray
@@ -36,79 +40,254 @@ import xarray
 from .parser import grammar
 
 
-def parse_value_node(value_node):
-    if value_node.data == "num":
-        val = float(value_node.children[0].value)
-    elif value_node.data == "nan":
-        val = np.nan
-    elif value_node.data == "string":
-        val = value_node.children[0].value[1:-1]
+_PARSER = None
+
+
+def _get_parser():
+    """Return the CDL parser, building the LALR tables on first use"""
+    global _PARSER
+    if _PARSER is None:
+        _PARSER = lark.Lark(
+            grammar, start="netcdf", parser="lalr", transformer=_ValueTransformer()
+        )
+    return _PARSER
+
+
+# numpy dtypes of the CDL types in the grammar. "long" is read as 64 bit to
+# round trip the output of dumps.
+_CDL_TO_NUMPY = {
+    "byte": np.int8,
+    "char": np.dtype("S1"),
+    "int": np.int32,
+    "long": np.int64,
+    "int64": np.int64,
+    "float": np.float32,
+    "double": np.float64,
+}
+
+# values used for data missing from the data section, by dtype kind
+_FILL_BY_KIND = {"f": np.nan, "S": b""}
+
+_COMMENT = re.compile(r"//.*")
+# an empty slot between commas, which numpy would read as -1
+_EMPTY_ITEM = re.compile(r",\s*,")
+# backslash escapes inside quoted strings
+_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+# whitespace, a comment, a value (group 1), a comma (group 2) or anything else
+# (group 3). Quoted strings are matched whole so text inside them is never
+# taken for a comment.
+_DATA_TOKEN = re.compile(
+    r'\s+|//[^\n]*|("(?:\\.|[^"\\])*"|(?:[^,\s"/]|/(?!/))+)|(,)|(.)'
+)
+
+
+def _parse_data(blob: str):
+    """Parse the comma-separated values of a ``data:`` entry
+
+    Numeric data is handed to numpy's C parser in a single call. Data
+    containing strings, or anything numpy cannot read, falls back to parsing
+    the values one at a time. Malformed data raises a ValueError.
+    """
+    if '"' not in blob:
+        # only run the comment regex when there is a comment
+        text = _COMMENT.sub("", blob) if "//" in blob else blob
+        if "NaNf" in text:
+            text = text.replace("NaNf", "NaN")
+        if "_" in text:
+            text = text.replace("_", "NaN")
+        stripped = text.strip()
+        if (
+            stripped[:1] not in ("", ",")
+            and stripped[-1:] != ","
+            and not _EMPTY_ITEM.search(stripped)
+        ):
+            with warnings.catch_warnings():
+                # numpy only warns when it cannot read the string to its end
+                warnings.simplefilter("error", DeprecationWarning)
+                try:
+                    values = np.fromstring(text, sep=",")
+                except (DeprecationWarning, ValueError):
+                    values = None
+            if values is not None and values.size == text.count(",") + 1:
+                return values
+
+    values = []
+    expect_value = True
+    for match in _DATA_TOKEN.finditer(blob):
+        item, comma, other = match.groups()
+        if item is not None:
+            if not expect_value:
+                raise ValueError(f"missing ',' before {item!r}")
+            values.append(_parse_data_item(item))
+            expect_value = False
+        elif comma is not None:
+            if expect_value:
+                raise ValueError("empty value before ','")
+            expect_value = True
+        elif other is not None:
+            raise ValueError(f"unexpected character {other!r}")
+    if expect_value:
+        raise ValueError("expected a value after ','" if values else "no values")
+    return values
+
+
+def _parse_data_item(item: str):
+    if item.startswith('"'):
+        return _ESCAPE.sub(r"\1", item[1:-1])
+    elif item in ("_", "NaN", "NaNf"):
+        return np.nan
     else:
-        raise ValueError(f"Cannot parse {value_node.data}")
-    return val
+        return float(item)
+
+
+def _char_array(shape, strings):
+    """Lay out the strings of a char variable along its last dimension
+
+    As with ncgen, each string fills one row of the last (character)
+    dimension, padded with empty bytes or truncated to fit.
+    """
+    arr = np.full(shape, b"", dtype="S1")
+    if arr.size == 0:
+        return arr
+    rows = arr.reshape(-1, shape[-1] if shape else 1)
+    for row, value in zip(rows, strings):
+        if not isinstance(value, str):
+            raise ValueError(f"expected a string, got {value!r}")
+        chars = value.encode()[: row.size]
+        row[: len(chars)] = np.frombuffer(chars, dtype="S1")
+    return arr
+
 
+def _check_integer_data(values, dtype):
+    """Raise a ValueError if ``values`` cannot be stored exactly as ``dtype``
+
+    Casting NaN or out-of-range floats to integers silently stores garbage,
+    so this is checked before the copy.
+    """
+    if np.isnan(values).any():
+        raise ValueError(f"NaN cannot be stored as {dtype}")
+    info = np.iinfo(dtype)
+    out_of_range = (values < info.min) | (values > info.max)
+    if out_of_range.any():
+        value = values[out_of_range][0].item()
+        raise ValueError(f"{value!r} is out of range for {dtype}")
+
+
+@lark.v_args(inline=True)
+class _ValueTransformer(lark.Transformer):
+    """Convert value nodes to python objects
+
+    This transformer holds no state, so it can be passed to the LALR parser to
+    be applied while parsing, without building a tree node for every number.
+    """
+
+    __slots__ = ()
+
+    def num(self, token):
+        return float(token)
+
+    def nan(self):
+        return np.nan
+
+    def string(self, token):
+        return token[1:-1]
 
-class DatasetVisitor(lark.Visitor):
-    """A class for traversing a parsed syntax tree
 
-    This class will iterate over the syntax tree of a CDL file and generate a
-    list of variable information that can be used to generate an xarray Dataset.
+@lark.v_args(inline=True)
+class DatasetTransformer(_ValueTransformer):
+    """A class for transforming a parsed syntax tree
 
-    For example, the ``.variable_decl`` method will be called when the tree
-    'visits' a node of type ``variable_decl``. Note how these method names match
+    This class will reduce the syntax tree of a CDL file bottom-up and collect
+    variable information that can be used to generate an xarray Dataset.
+
+    For example, the ``.variable_decl`` method will be called with the children
+    of each node of type ``variable_decl``. Note how these method names match
     the rules in the vcm.cdl.grammar.
     """
 
+    __slots__ = (
+        "_variable_dims",
+        "_variable_dtype",
+        "_variable_attrs",
+        "_dims",
+        "_variable_data",
+    )
+
     def __init__(self):
+        super().__init__()
         self._variable_dims = {}
         self._variable_dtype = {}
         self._variable_attrs = {}
         self._dims: Mapping[str, int] = {}
         self._variable_data = {}
 
-    def dimension_pair(self, v):
-        dim = v.children[0].value
-        size = (
-            int(v.children[1].value)
-            if v.children[1].type == "INT"
-            else v.children[1].value
-        )
-        self._dims[dim] = size
+    def var_dims(self, *dims):
+        return [sys.intern(str(dim)) for dim in dims]
 
-    def variable_decl(self, v):
-        dtype_node, name, dims_node = v.children
-        name = str(name)
+    def dimension_pair(self, dim, dim_size):
+        size = int(dim_size) if dim_size.type == "INT" else dim_size.value
+        self._dims[sys.intern(dim.value)] = size
+
+    def variable_decl(self, dtype_node, name, dims):
+        name = sys.intern(str(name))
         dtype_str = dtype_node.data
-        dims = [str(dim) for dim in dims_node.children] if dims_node else []
-        self._variable_dims[name] = dims
-        self._variable_dtype[name] = {"float": np.float32, "int": np.int32}.get(dtype_str, dtype_str)
+        self._variable_dims[name] = dims if dims else []
+        self._variable_dtype[name] = _CDL_TO_NUMPY[dtype_str]
 
-    def variable_attr(self, v):
-        varname, attr_node, value_node = v.children
+    def variable_attr(self, varname, attr_node, value):
         attrname = attr_node.value
         attrs = self._variable_attrs.setdefault(varname.value if varname else None, {})
-        attrs[attrname] = parse_value_node(value_node)
+        attrs[attrname] = value
 
-    def datum(self, v):
-        varname = v.children[0].value
+    def datum(self, varname, blob):
+        varname = sys.intern(varname.value)
         assert varname in self._variable_dims
-        # get data stored in self.list
-        self._variable_data[varname] = list(v.children[1].data)
-
-    def list(self, v):
-        # Store the data in the tree to be used later on in self.datum
-        v.data = [parse_value_node(node) for node in v.children]
+        is_char = np.dtype(self._variable_dtype[varname]).kind == "S"
+        try:
+            data = _parse_data(blob)
+            # the per-value parser returns a list, which may hold strings
+            if not is_char and isinstance(data, list):
+                for value in data:
+                    if isinstance(value, str):
+                        raise ValueError(f"unexpected string {value!r}")
+            self._variable_data[varname] = data
+        except ValueError as e:
+            raise ValueError(
+                f"Invalid data for variable {varname!r} at line {blob.line}: {e}"
+            ) from e
 
     def generate_dataset(self):
         data_vars = {}
         for name in self._variable_dims:
             shape = tuple(self._dims[k] for k in self._variable_dims[name])
-            arr = np.zeros(shape, dtype=self._variable_dtype[name])
-            if name in self._variable_data:
+            dtype = np.dtype(self._variable_dtype[name])
+            fill_value = _FILL_BY_KIND.get(dtype.kind, 0)
+            if name in self._variable_data and dtype.kind == "S":
+                try:
+                    arr = _char_array(shape, self._variable_data[name])
+                except ValueError as e:
+                    raise ValueError(
+                        f"Invalid data for char variable {name!r}: {e}"
+                    ) from e
+            elif name in self._variable_data:
                 data = self._variable_data[name]
+                arr = np.empty(shape, dtype=dtype)
                 view = arr.ravel()
                 n = min(view.size, len(data))
-                view[:n] = data[:n]
+                values = np.asarray(data[:n])
+                if dtype.kind in "iu":
+                    try:
+                        _check_integer_data(values, dtype)
+                    except ValueError as e:
+                        raise ValueError(
+                            f"Invalid data for variable {name!r}: {e}"
+                        ) from e
+                view[:n] = values
+                # pad values missing from the data section
+                if n < view.size:
+                    view[n:] = fill_value
+            else:
+                arr = np.full(shape, fill_value, dtype=dtype)
 
             data_vars[name] = (
                 self._variable_dims[name],
@@ -120,7 +299,32 @@ class DatasetVisitor(lark.Visitor):
         return xarray.Dataset(data_vars, attrs=attrs)
 
 
-def loads(cdl: str) -> xarray.Dataset:
+# attributes that xarray.decode_cf acts on
+_CF_ATTRS = frozenset(
+    [
+        "_FillValue",
+        "missing_value",
+        "scale_factor",
+        "add_offset",
+        "_Unsigned",
+        "units",
+        "calendar",
+        "coordinates",
+        "dtype",
+    ]
+)
+
+
+def _needs_cf_decoding(ds: xarray.Dataset) -> bool:
+    if "coordinates" in ds.attrs:
+        return True
+    return any(
+        var.dtype.kind == "S" or not _CF_ATTRS.isdisjoint(var.attrs)
+        for var in ds.variables.values()
+    )
+
+
+def loads(cdl: str, decode_cf: bool = True) -> xarray.Dataset:
     """Convert a CDL string into a xarray dataset
 
     Useful for generating synthetic data for testing
@@ -147,16 +351,24 @@ def loads(cdl: str) -> xarray.Dataset:
             59, 61, 67, 71, 73, 79, 83, 89 ;
         }
 
+    If ``decode_cf`` is True, the dataset is passed through
+    :func:`xarray.decode_cf` when any of its variables carry CF encoding
+    attributes such as ``_FillValue`` or ``units``.
+
     .. _CDL: https://www.unidata.ucar.edu/software/netcdf/workshops/most-recent/nc3model/Cdl.html
 
     """  # noqa
-    # create the parser
-    cdl_parser = lark.Lark(grammar, start="netcdf", parser="lalr")
     # parse the string into a syntax tree
-    tree = cdl_parser.parse(cdl)
+    tree = _get_parser().parse(cdl)
     # collects lists of all the variables, data, and metadata
-    v = DatasetVisitor()
-    v.visit(tree)
+    v = DatasetTransformer()
+    try:
+        v.transform(tree)
+    except lark.exceptions.VisitError as e:
+        # report errors from the callbacks rather than lark's wrapper
+        raise e.orig_exc from e
     # finally generate the dataset
     ds = v.generate_dataset()
-    return xarray.decode_cf(ds)
+    if decode_cf and _needs_cf_decoding(ds):
+        return xarray.decode_cf(ds)
+    return ds
@@ -71,9 +71,10 @@ dtype: "float"  -> float
 
 // data
 data: "data" ":" [datum*]
-datum: symbol "=" list ";"
-list: data_value("," data_value)*
-?data_value: value | "_"
+datum: symbol "=" DATA_BLOB ";"
+// the comma-separated values are parsed in bulk by numpy, not by the grammar
+// comments and quoted strings are consumed whole so a ; inside them is kept
+DATA_BLOB: /(?:[^;"\/]+|\/(?!\/)|\/\/[^\n]*|"(?:\\.|[^"\\])*")+/
 
 // General purpose
 ?symbol: CNAME
@@ -32,7 +32,7 @@ import numpy as np
 import lark
 import xarray as xr
 from xarray_cdl.parser import grammar as parser
-from xarray_cdl.generate import DatasetVisitor
+from xarray_cdl.generate import DatasetTransformer, _parse_data
 from xarray_cdl import loads, dumps
 import pytest
 
@@ -84,6 +84,181 @@ def test_get_data():
     assert ds.global_attr == 1
 
 
+def test_get_data_partial():
+    ds = loads(
+        """
+    netcdf Some Data {
+    dimensions:
+        x = 4;
+    variables:
+        double a(x);
+        int b(x);
+    data:
+        a = 1, 2;
+        b = 1, 2;
+    }
+    """
+    )
+
+    np.testing.assert_array_equal(ds["a"], [1, 2, np.nan, np.nan])
+    np.testing.assert_array_equal(ds["b"], [1, 2, 0, 0])
+
+
+def test_get_data_fill_values():
+    ds = loads(
+        """
+    netcdf Some Data {
+    dimensions:
+        x = 6;
+    variables:
+        double a(x);
+    data:
+        a = 1, NaN, // a comment
+            NaNf, _,
+            -2.5e3, 6;
+    }
+    """
+    )
+
+    np.testing.assert_array_equal(ds["a"], [1, np.nan, np.nan, np.nan, -2500, 6])
+
+
+def test_get_data_comment_with_delimiters():
+    ds = loads(
+        """
+    netcdf Some Data {
+    dimensions:
+        x = 4;
+    variables:
+        double a(x);
+    data:
+        a = 1, 2, // note; hi
+            3, // it"s
+            4;
+    }
+    """
+    )
+
+    np.testing.assert_array_equal(ds["a"], [1, 2, 3, 4])
+
+
+def test_parse_data_comment_in_string():
+    assert _parse_data('"a//b", // comment\n "c"') == ["a//b", "c"]
+
+
+@pytest.mark.parametrize(
+    'data', ['1,,2', '1, , 2', '1 2', '1, 2,', ', 1', '1, foo', '1, "a", 3']
+)
+def test_loads_invalid_data(data):
+    cdl = f"""
+    netcdf Some Data {{
+    dimensions:
+        x = 3;
+    variables:
+        double s(x);
+    data:
+        s = {data};
+    }}
+    """
+
+    with pytest.raises(ValueError, match="variable 's' at line 8"):
+        loads(cdl)
+
+
+@pytest.mark.parametrize('data', ['1, NaN', '1, _', '1, 1e20'])
+def test_loads_invalid_integer_data(data):
+    cdl = f"""
+    netcdf Some Data {{
+    dimensions:
+        x = 2;
+    variables:
+        int a(x);
+    data:
+        a = {data};
+    }}
+    """
+
+    with pytest.raises(ValueError, match="Invalid data for variable 'a'"):
+        loads(cdl)
+
+
+def test_loads_decode_cf():
+    cdl = """
+    netcdf Some Data {
+    dimensions:
+        x = 2;
+    variables:
+        double a(x);
+            a:_FillValue = 0;
+    data:
+        a = 0, 1;
+    }
+    """
+
+    np.testing.assert_array_equal(loads(cdl)["a"], [np.nan, 1])
+    raw = loads(cdl, decode_cf=False)
+    np.testing.assert_array_equal(raw["a"], [0, 1])
+    assert raw["a"].attrs == {"_FillValue": 0}
+
+
+def test_loads_declared_dtypes():
+    ds = loads(
+        """
+    netcdf Some Data {
+    dimensions:
+        x = 2;
+    variables:
+        byte a(x);
+        int b(x);
+        long c(x);
+        float d(x);
+        double e(x);
+    }
+    """
+    )
+
+    assert [ds[v].dtype for v in "abcde"] == [
+        np.int8, np.int32, np.int64, np.float32, np.float64
+    ]
+    np.testing.assert_array_equal(ds["b"], [0, 0])
+    np.testing.assert_array_equal(ds["e"], [np.nan, np.nan])
+
+
+def test_loads_char_data():
+    cdl = """
+    netcdf Some Data {
+    dimensions:
+        x = 3;
+        n = 3;
+    variables:
+        char s(x, n);
+    data:
+        s = "abc", "de", "fghi";
+    }
+    """
+
+    assert loads(cdl)["s"].values.tolist() == [b"abc", b"de", b"fgh"]
+    raw = loads(cdl, decode_cf=False)["s"]
+    assert raw.dims == ("x", "n")
+    assert raw.values[1].tolist() == [b"d", b"e", b""]
+
+
+def test_loads_char_numeric_data():
+    cdl = """
+    netcdf Some Data {
+    dimensions:
+        n = 3;
+    variables:
+        char s(n);
+    data:
+        s = 1, 2;
+    }
+    """
+
+    with pytest.raises(ValueError, match="char variable 's'"):
+        loads(cdl)
+
+
 def test_dumps_basic():
     """Test basic dumps functionality"""
     ds = xr.Dataset(
@@ -116,7 +291,8 @@ def test_dumps_loads_roundtrip(dtype):
     ds = xr.Dataset(
         data_vars={
             'temperature': (['time', 'lat'], temp_data),
-            'pressure': (['time'], [1013, 1014])
+            'pressure': (['time'], [1013, 1014]),
+            'valid': (['time'], [True, False]),
         },
         coords={
             'time': [0, 1],
@@ -143,6 +319,29 @@ def test_dumps_loads_roundtrip(dtype):
         assert ds[v].dtype == ds_roundtrip[v].dtype
 
 
+def test_dumps_loads_strings():
+    """Test string variables round trip as char variables"""
+    ds = xr.Dataset(
+        data_vars={
+            'name': (['x'], np.array(['ab', 'c"d', ''])),
+            'code': (['x'], np.array([b'xy', b'z', b''])),
+            'label': 'scalar',
+        },
+        coords={'x': [0, 1, 2]},
+    )
+
+    cdl = dumps(ds, "strings")
+
+    assert "char name(x, string3);" in cdl
+    assert 'name = "ab", "c\\"d", "";' in cdl
+    xr.testing.assert_identical(ds, loads(cdl))
+    assert dumps(loads(cdl, decode_cf=False), "strings") == cdl
+
+    # single characters with an empty character dimension
+    empty = xr.Dataset(data_vars={'c': (['x', 'n'], np.zeros((3, 0), dtype='S1'))})
+    assert "char c(x, n);" in dumps(empty, "empty_chars")
+
+
 def test_dumps_with_nan():
     """Test dumps handles NaN values correctly"""
     ds = xr.Dataset(
@@ -158,6 +357,64 @@ def test_dumps_with_nan():
     assert "1.0, NaN, 3.0;" in cdl
 
 
+def test_dumps_preserves_precision():
+    """Test dumps writes floats with enough digits to round trip"""
+    values = np.array([1 / 3, 1e20, -0.0, np.nan])
+    ds = xr.Dataset(data_vars={'a': (['x'], values)})
+
+    cdl = dumps(ds, "precision_test")
+
+    assert "0.3333333333333333, 1e+20, -0.0, NaN;" in cdl
+    xr.testing.assert_identical(loads(cdl), ds)
+
+
+def test_dumps_wraps_data_lines():
+    """Test dumps writes eight values per line of data"""
+    ds = xr.Dataset(data_vars={'a': (['x'], np.arange(10))})
+
+    cdl = dumps(ds, "wrap_test")
+
+    assert "    a = 0, 1, 2, 3, 4, 5, 6, 7,\n    8, 9;" in cdl
+
+
+def test_dumps_dask():
+    """Test dumps writes chunked variables in C order"""
+    pytest.importorskip("dask")
+    ds = xr.Dataset(
+        data_vars={'a': (['x', 'y'], np.arange(12.0).reshape(4, 3))},
+        coords={'x': [0, 1, 2, 3], 'y': [0, 1, 2]},
+    )
+    chunked = ds.chunk({'x': 3, 'y': 2})
+
+    cdl = dumps(chunked, "dask_test")
+    ds_roundtrip = loads(cdl)
+
+    assert "7.0,\n    8.0, 9.0, 10.0, 11.0;" in cdl
+    xr.testing.assert_equal(ds, ds_roundtrip)
+
+
+def test_dumps_attribute_values():
+    """Test dumps formats numpy and bool attributes as CDL values"""
+    ds = xr.Dataset(
+        attrs={
+            'flag': True,
+            'scale': np.float32(0.1),
+            'missing': np.float32(np.nan),
+            'count': np.array(3),
+            'name': np.array("abc", dtype=object),
+        }
+    )
+
+    cdl = dumps(ds, "attrs_test")
+
+    assert ":flag = 1;" in cdl
+    assert ":scale = 0.1;" in cdl
+    assert ":missing = NaN;" in cdl
+    assert ":count = 3;" in cdl
+    assert ':name = "abc";' in cdl
+    assert loads(cdl).attrs["scale"] == 0.1
+
+
 def test_dumps_empty_dataset():
     """Test dumps with an empty dataset"""
     ds = xr.Dataset()
@@ -247,13 +504,13 @@ def test_lark():
 def test_parse_data_value():
     cdl_parser = lark.Lark(parser, start="variable_decl")
     tree = cdl_parser.parse("float a(x,y);")
-    v = DatasetVisitor()
-    v.visit(tree)
+    v = DatasetTransformer()
+    v.transform(tree)
     assert v._variable_dtype["a"] == np.float32
     assert v._variable_dims["a"] == ["x", "y"]
 
 
-def test_Visitor():
+def test_Transformer():
     cdl_parser = lark.Lark(parser, start="netcdf")
     cdl = """netcdf Some Data {
     dimensions:
@@ -269,8 +526,8 @@ def test_Visitor():
         time = 1,2,3;
     }"""
     tree = cdl_parser.parse(cdl)
-    v = DatasetVisitor()
-    v.visit(tree)
+    v = DatasetTransformer()
+    v.transform(tree)
     assert v._dims == {"time": 3, "x": 4}
 
     assert v._variable_attrs["a"] == {"_FillValue": 0}